@@ -1,4 +1,4 @@
 from .api import Event
-from .photoshop_connection import PhotoshopConnection
+from .photoshop_connection import PhotoshopConnection, PhotoshopConnectionPool
 
-__all__ = ["Event", "PhotoshopConnection"]
+__all__ = ["Event", "PhotoshopConnection", "PhotoshopConnectionPool"]
@@ -5,16 +5,45 @@ https://github.com/adobe-photoshop/generator-core/wiki/Photoshop-Kevlar-API-Addi
 """
 from __future__ import annotations
 
-import json
+import inspect
 import logging
 from enum import Enum
-from typing import Any, Dict, Optional, Sequence, Tuple, Union
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Sequence, Tuple, Union
 
-from photoshop.protocol import ContentType, Pixmap
+from photoshop.protocol import ContentType, Pixmap, json_loads
 
 logger = logging.getLogger(__name__)
 
 
+def _layer_shape_script(
+    document: Optional[str],
+    layer: Optional[Union[int, Tuple[int, int]]],
+    version: str,
+    placed_ids: Optional[Sequence[str]],
+) -> str:
+    """Format the ExtendScript of :py:meth:`Kevlar.get_layer_shape`."""
+    lines = [
+        'var idNS = stringIDToTypeID("sendLayerShapeToNetworkClient");',
+        "var desc1 = new ActionDescriptor();",
+    ]
+    if document:
+        lines.append('desc1.putInteger(stringIDToTypeID("documentID"), %s);' % document)
+    if placed_ids:
+        lines.append("var placedList = new ActionList();")
+        lines.extend('placedList.putString("%s");' % id_ for id_ in placed_ids)
+        lines.append('desc1.putList(stringIDToTypeID("placedID"), placedList);')
+    if isinstance(layer, (tuple, list)):
+        lines.append('desc1.putInteger(stringIDToTypeID("firstLayer"), %s);' % layer[0])
+        lines.append('desc1.putInteger(stringIDToTypeID("lastLayer"), %s);' % layer[1])
+    elif isinstance(layer, int):
+        lines.append('desc1.putInteger(stringIDToTypeID("layerID"), %d);' % layer)
+    else:
+        lines.append('desc1.putBoolean(stringIDToTypeID("selectedLayers"), true);')
+    lines.append('desc1.putString(stringIDToTypeID("version"), "%s");' % version)
+    lines.append("executeAction(idNS, desc1, DialogModes.NO);")
+    return "\n".join(lines)
+
+
 class Event(str, Enum):
     """
     List of events in :py:meth:`~photoshop.PhotoshopConnection.subscribe`.
@@ -46,6 +75,8 @@ class Event(str, Enum):
 class Kevlar(object):
     """Kevlar API wrappers."""
 
+    __slots__ = ()
+
     def _render(self, template_file: str, context: Dict[str, Any]) -> str:
         """
         Render script template.
@@ -71,6 +102,32 @@ class Kevlar(object):
         """
         raise NotImplementedError()
 
+    def execute_stream(
+        self, script: str, count: int, timeout: Optional[float] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Execute the given ExtendScript in Photoshop and yield the next `count`
+        responses as they arrive. The script is sent before this returns.
+
+        :param script: ExtendScript to execute in Photoshop.
+        :param count: number of responses to receive.
+        :param timeout: Timeout in seconds to wait for each response.
+        :return: iterator of `dict`. See :py:meth:`execute`.
+
+        :raise RuntimeError: if error happens in remote.
+        """
+        raise NotImplementedError()
+
+    def _execute_output(self, script: str, content_type: ContentType) -> Any:
+        """
+        Execute a script that sends back output, check the content type of the
+        output once, and return its body.
+        """
+        response = self.execute(script, receive_output=True)
+        if response["content_type"] is not content_type:
+            raise RuntimeError("Unexpected response: %.256s" % response)
+        return response["body"]
+
     def get_document_thumbnail(
         self,
         document: Optional[str] = None,
@@ -93,10 +150,15 @@ class Kevlar(object):
             :py:class:`~photoshop.protocol.Pixmap` if `format` is 2.
         :raise RuntimeError: if error happens in remote.
         """
-        script = self._render("sendDocumentThumbnailToNetworkClient.js.j2", locals())
-        response = self.execute(script, receive_output=True)
-        assert response["content_type"] == ContentType.IMAGE
-        return response.get("body", {}).get("data")  # type: ignore
+        context = dict(
+            document=document,
+            max_width=max_width,
+            max_height=max_height,
+            format=format,
+            placed_ids=placed_ids,
+        )
+        script = self._render("sendDocumentThumbnailToNetworkClient.js.j2", context)
+        return self._execute_output(script, ContentType.IMAGE)["data"]  # type: ignore
 
     def get_layer_thumbnail(
         self,
@@ -285,10 +347,67 @@ class Kevlar(object):
             the group (and vice-versa). The range can also just include layers
             inside a group with no group layers at all.
         """
-        script = self._render("sendLayerThumbnailToNetworkClient.js.j2", locals())
-        response = self.execute(script, receive_output=True)
-        assert response["content_type"] == ContentType.IMAGE
-        return response.get("body", {}).get("data")  # type: ignore
+        context = dict(
+            document=document,
+            max_width=max_width,
+            max_height=max_height,
+            convert_rgb_profile=convert_rgb_profile,
+            icc_profile=icc_profile,
+            interpolation=interpolation,
+            transform=transform,
+            layer=layer,
+            layer_settings=layer_settings,
+            image_settings=image_settings,
+            include_layers=include_layers,
+            clip_bounds=clip_bounds,
+            bounds=bounds,
+            bounds_only=bounds_only,
+            thread=thread,
+            layer_comp_id=layer_comp_id,
+            layer_comp_index=layer_comp_index,
+            dither=dither,
+            color_dither=color_dither,
+        )
+        script = self._render("sendLayerThumbnailToNetworkClient.js.j2", context)
+        return self._execute_output(script, ContentType.IMAGE)["data"]  # type: ignore
+
+    def get_layer_thumbnails(
+        self, requests: Sequence[Dict[str, Any]]
+    ) -> Iterator[Optional[Pixmap]]:
+        """
+        Send thumbnails of several layers in a single round trip.
+
+        All the thumbnail requests are combined into one ExtendScript, and the
+        thumbnails are yielded in order as they arrive.
+
+        :param requests: sequence of `dict` of keyword arguments to
+            :py:meth:`get_layer_thumbnail`.
+        :return: iterator of :py:class:`~photoshop.protocol.Pixmap` or `None`.
+        :raise RuntimeError: if error happens in remote.
+
+        Example::
+
+            requests = [dict(layer=layer_id) for layer_id in (1, 2, 3)]
+            for pixmap in conn.get_layer_thumbnails(requests):
+                pixmap.topil().show()
+        """
+        signature = inspect.signature(Kevlar.get_layer_thumbnail)
+        scripts = []
+        for request in requests:
+            arguments = signature.bind(self, **request)
+            arguments.apply_defaults()
+            context = dict(arguments.arguments)
+            del context["self"]
+            scripts.append(
+                self._render("sendLayerThumbnailToNetworkClient.js.j2", context)
+            )
+        # One response per thumbnail, plus the result of the script itself.
+        responses = self.execute_stream("\n".join(scripts), len(scripts) + 1)
+        return (
+            response.get("body", {}).get("data")
+            for response in responses
+            if response["content_type"] == ContentType.IMAGE
+        )
 
     def get_layer_shape(
         self,
@@ -362,10 +481,10 @@ class Kevlar(object):
 
         :raise RuntimeError: if error happens in remote.
         """  # noqa
-        script = self._render("sendLayerShapeToNetworkClient.js.j2", locals())
-        response = self.execute(script, receive_output=True)
-        assert response["content_type"] == ContentType.SCRIPT
-        return json.loads(response.get("body", b"{}").decode("utf-8"))  # type: ignore
+        script = _layer_shape_script(document, layer, version, placed_ids)
+        return json_loads(  # type: ignore
+            self._execute_output(script, ContentType.SCRIPT)
+        )
 
     def get_document_info(
         self,
@@ -422,12 +541,34 @@ class Kevlar(object):
             may not be accurate).
         :return: `dict`.
         :raise RuntimeError: if error happens in remote.
+
+        .. note:: The response for a large document can be several megabytes
+            of JSON. When only part of it is needed, narrow the request with
+            `layer`, `image_info`, `comp_info` and `layer_info` so that
+            Photoshop skips the unused sections instead of serializing them
+            to be parsed and discarded here.
         """
         # TODO: Implement whichInfo option.
-        script = self._render("sendDocumentInfoToNetworkClient.js.j2", locals())
-        response = self.execute(script, receive_output=True)
-        assert response["content_type"] == ContentType.SCRIPT
-        return json.loads(response.get("body", b"{}").decode("utf-8"))  # type: ignore
+        context = dict(
+            version=version,
+            document=document,
+            placed_ids=placed_ids,
+            layer=layer,
+            expand_smart_objects=expand_smart_objects,
+            get_text_styles=get_text_styles,
+            get_full_text_styles=get_full_text_styles,
+            get_default_layer_effect=get_default_layer_effect,
+            get_comp_layer_settings=get_comp_layer_settings,
+            get_path_data=get_path_data,
+            image_info=image_info,
+            comp_info=comp_info,
+            layer_info=layer_info,
+            include_ancestors=include_ancestors,
+        )
+        script = self._render("sendDocumentInfoToNetworkClient.js.j2", context)
+        return json_loads(  # type: ignore
+            self._execute_output(script, ContentType.SCRIPT)
+        )
 
     def get_document_stream(
         self,
@@ -465,7 +606,8 @@ class Kevlar(object):
             - `fullSize` : total number of bytes in file.
             - `path` : string, server-local path to file if path was set to true
               in the request).
-            - `data`: actual data in bytes. if `path` is True, this is empty.
+            - `data`: actual data as a read-only `memoryview` into the
+              response. if `path` is True, this is empty.
 
         :raise RuntimeError: if error happens in remote.
 
@@ -474,7 +616,52 @@ class Kevlar(object):
             To return chunks, or the path format to write it to a temp file.
             Document stream/attributes are returned as a FileStream Reply.
         """
-        script = self._render("sendDocumentStreamToNetworkClient.js.j2", locals())
-        response = self.execute(script, receive_output=True)
-        assert response["content_type"] == ContentType.FILE_STREAM
-        return response.get("body")  # type: ignore
+        context = dict(
+            document=document,
+            placed_ids=placed_ids,
+            placed_id=placed_id,
+            layer=layer,
+            position=position,
+            size=size,
+            path_only=path_only,
+        )
+        script = self._render("sendDocumentStreamToNetworkClient.js.j2", context)
+        return self._execute_output(script, ContentType.FILE_STREAM)  # type: ignore
+
+    def get_document_stream_into(
+        self, sink: BinaryIO, chunk_size: int = 4 << 20, **kwargs: Any
+    ) -> int:
+        """
+        Write the file stream for a smart object into `sink` chunk by chunk,
+        so that the whole file is never held in memory at once.
+
+        :param sink: writable binary file object.
+        :param chunk_size: number of bytes to request at a time, default 4 MiB.
+        :param kwargs: other arguments to :py:meth:`get_document_stream`,
+            except `position`, `size` and `path_only`.
+        :return: number of bytes written.
+        :raise RuntimeError: if error happens in remote, or the replies do not
+            cover the whole file.
+
+        Example::
+
+            with open('smart_object.psb', 'wb') as f:
+                conn.get_document_stream_into(f, layer=1)
+        """
+        position = 0
+        while True:
+            info = self.get_document_stream(
+                position=position, size=chunk_size, **kwargs
+            )
+            full_size = info.get("fullSize")
+            if full_size is None:
+                raise RuntimeError("FileStream reply without fullSize: %.256s" % info)
+            data = info.pop("data")
+            sink.write(data)
+            position += len(data)
+            if position >= full_size:
+                return position
+            if not len(data):
+                raise RuntimeError(
+                    "FileStream ended at %d of %d bytes" % (position, full_size)
+                )
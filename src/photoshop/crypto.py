@@ -1,15 +1,24 @@
+import functools
+import hashlib
 import logging
 
 from cryptography.hazmat.backends import default_backend
-from cryptography.hazmat.primitives import hashes, padding
 from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 
 logger = logging.getLogger(__name__)
 
 
 SALT = b"Adobe Photoshop"
 
+# PKCS7 padding for each pad length of the 8-byte TripleDES block.
+_PADDING = [bytes((size,)) * size for size in range(9)]
+
+
+@functools.lru_cache(maxsize=32)
+def _derive_key(password: bytes, salt: bytes, iterations: int, length: int) -> bytes:
+    """Derive the cipher key, memoized so that reconnecting skips PBKDF2."""
+    return hashlib.pbkdf2_hmac("sha1", password, salt, iterations, length)
+
 
 class EncryptDecrypt(object):
     def __init__(
@@ -20,26 +29,72 @@ class EncryptDecrypt(object):
         length: int = 24,
     ):
         backend = default_backend()
-        self.kdf = PBKDF2HMAC(
-            algorithm=hashes.SHA1(),
-            length=length,
-            salt=salt,
-            iterations=iterations,
-            backend=backend,
-        )
-        key = self.kdf.derive(password)
+        key = _derive_key(password, salt, iterations, length)
         iv = b"\x00" * 8  # Always zeros.
         self.cipher = Cipher(algorithms.TripleDES(key), modes.CBC(iv), backend)
-        self.padding = padding.PKCS7(algorithms.TripleDES.block_size)
+        self.block_size = algorithms.TripleDES.block_size // 8
+
+    def encrypted_size(self, size: int) -> int:
+        """Return the ciphertext size of a `size`-byte message."""
+        return (size // self.block_size + 1) * self.block_size
+
+    def encrypt_into(
+        self, message: bytes, buffer: bytearray, offset: int = 0, header: bytes = b""
+    ) -> int:
+        """
+        Encrypt `header` followed by `message` into `buffer` starting at
+        `offset`, without joining the two in memory first.
+
+        The cipher needs `block_size - 1` bytes of scratch space, so `buffer`
+        must hold `encrypted_size(len(header) + len(message)) + block_size - 1`
+        bytes after `offset`.
+
+        :return: number of bytes written.
+        """
+        pad = self.block_size - (len(header) + len(message)) % self.block_size
+        encryptor = self.cipher.encryptor()
+        with memoryview(buffer) as view:
+            written = encryptor.update_into(header, view[offset:])
+            written += encryptor.update_into(message, view[offset + written :])
+            written += encryptor.update_into(_PADDING[pad], view[offset + written :])
+        encryptor.finalize()
+        return written
+
+    def decrypt_into(self, token: bytes, buffer: bytearray) -> int:
+        """
+        Decrypt `token` into `buffer` and strip the padding in place.
+
+        The cipher needs `block_size - 1` bytes of scratch space, so `buffer`
+        must hold `len(token) + block_size - 1` bytes.
+
+        :return: size of the message at the start of `buffer`.
+        :raise ValueError: if the padding is invalid.
+        """
+        decryptor = self.cipher.decryptor()
+        written = decryptor.update_into(token, buffer)
+        decryptor.finalize()
+        return self._unpadded_size(buffer, written)
+
+    def _unpadded_size(self, buffer: bytes, size: int) -> int:
+        """Validate the PKCS7 padding of `buffer[:size]` and strip it."""
+        pad = buffer[size - 1] if size else 0
+        if not 0 < pad <= self.block_size or (
+            buffer.count(pad, size - pad, size) != pad
+        ):
+            raise ValueError("Invalid padding bytes.")
+        return size - pad
 
     def encrypt(self, message: bytes) -> bytes:
-        padder = self.padding.padder()
-        padded_message = padder.update(message) + padder.finalize()
+        pad = self.block_size - len(message) % self.block_size
         encryptor = self.cipher.encryptor()
-        return encryptor.update(padded_message) + encryptor.finalize()
+        return (
+            encryptor.update(message)
+            + encryptor.update(_PADDING[pad])
+            + encryptor.finalize()
+        )
 
     def decrypt(self, token: bytes) -> bytes:
         decryptor = self.cipher.decryptor()
         padded_message = decryptor.update(token) + decryptor.finalize()
-        unpadder = self.padding.unpadder()
-        return unpadder.update(padded_message) + unpadder.finalize()
+        size = self._unpadded_size(padded_message, len(padded_message))
+        return padded_message[:size]
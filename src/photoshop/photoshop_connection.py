@@ -3,90 +3,377 @@ Photoshop session.
 """
 from __future__ import annotations
 
+import asyncio
+import collections
+import concurrent.futures
 import contextlib
+import functools
+import itertools
 import logging
 import os
 import queue
 import socket
+import sys
 import threading
-from typing import Any, Callable, Dict, Iterator, List, Optional, Type
-
-from jinja2 import Environment, FileSystemLoader
+import time
+import weakref
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    FrozenSet,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+)
+
+from jinja2 import (
+    DictLoader,
+    Environment,
+    FileSystemBytecodeCache,
+    Template,
+    meta,
+    nodes,
+)
 from photoshop.api import Event, Kevlar
-from photoshop.protocol import ContentType, Protocol
+from photoshop.protocol import ContentType, Protocol, SocketReader, sendmsg_all
 
 logger = logging.getLogger(__name__)
 
+# Content types that signal a failed command.
+_ERROR_CONTENT_MASK = (1 << ContentType.ILLEGAL) | (1 << ContentType.ERROR_STRING)
 
-class Transaction(object):
-    """Transaction class."""
 
-    _id = 0
-    lock = threading.Lock()
+class BatchingSendQueue(object):
+    """
+    Send queue that coalesces pending frames into a single write.
+
+    Frames are appended without blocking, and whichever thread acquires the
+    send lock first drains every pending frame with one `sendall`.
+    """
 
-    def __init__(self, protocol: Protocol, socket: socket.socket, lock: threading.Lock):
-        self.id = self._id
-        self.queue: queue.Queue = queue.Queue()
-        self.protocol = protocol
+    def __init__(self, socket: socket.socket, lock: threading.Lock):
         self.socket = socket
         self.lock = lock
-        self.__class__._id += 1
+        self.frames: Deque[bytes] = collections.deque()
 
-    @classmethod
-    def reset(cls, value: int = 0) -> None:
-        cls._id = value
+    def put(self, frame: bytes, flush: bool = True) -> None:
+        self.frames.append(frame)
+        if flush:
+            self.flush()
 
-    def send(self, content_type: ContentType, data: bytes) -> None:
+    def flush(self) -> None:
         with self.lock:
-            self.protocol.send(self.socket, content_type, data, self.id)
+            frames = []
+            while self.frames:
+                frames.append(self.frames.popleft())
+            if frames:
+                logger.debug("Flushing %d frames.", len(frames))
+                sendmsg_all(self.socket, frames)
 
-    def receive(self, **kwargs: Any) -> Dict[str, Any]:
-        response = self.queue.get(**kwargs)
-        self.queue.task_done()
 
+class Transaction(object):
+    """Transaction class."""
+
+    def __init__(self, protocol: Protocol, sender: BatchingSendQueue, txn_id: int):
+        self.id = txn_id
+        self._ready = threading.Event()
+        self._slot: Deque[Any] = collections.deque()
+        self.protocol = protocol
+        self.sender = sender
+        self.callback: Optional[Callable[[Any], None]] = None
+
+    def send(self, content_type: ContentType, data: bytes, flush: bool = True) -> None:
+        self.sender.put(self.protocol.pack(content_type, data, self.id), flush)
+
+    def put(self, item: Any) -> None:
+        """Deliver a response or an exception to the receiving thread."""
+        if self.callback is not None:
+            self.callback(item)
+            return
+        self._slot.append(item)
+        self._ready.set()
+
+    def _get(self, timeout: Optional[float] = None) -> Any:
+        return self._get_n(1, timeout)[0]
+
+    def _get_n(self, n: int, timeout: Optional[float] = None) -> List[Any]:
+        # An exception is always the last item delivered, so stop waiting
+        # for more once one arrives.
+        slot = self._slot
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while len(slot) < n and not (slot and isinstance(slot[-1], Exception)):
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                raise queue.Empty()
+            if not self._ready.wait(remaining):
+                raise queue.Empty()
+            self._ready.clear()
+        return [slot.popleft() for _ in range(min(n, len(slot)))]
+
+    def receive(self, timeout: Optional[float] = None) -> Dict[str, Any]:
+        return self.check(self._get(timeout))
+
+    def receive_n(
+        self, n: int, timeout: Optional[float] = None
+    ) -> List[Dict[str, Any]]:
+        """Wait once for `n` responses, `timeout` covering all of them."""
+        return [self.check(item) for item in self._get_n(n, timeout)]
+
+    @staticmethod
+    def check(response: Any) -> Dict[str, Any]:
+        """Raise if the delivered item is an exception or an error response."""
         if isinstance(response, Exception):
             raise response
 
-        assert response["status"] == 0
-        assert response["content_type"] not in (
-            ContentType.ILLEGAL,
-            ContentType.ERROR_STRING,
-        )
-        message = "%s" % response
-        logger.debug(message if len(message) < 256 else message[:256] + "...")
+        if response["status"] or (1 << response["content_type"]) & _ERROR_CONTENT_MASK:
+            raise RuntimeError("Unexpected response: %.256s" % response)
+        logger.debug("%.256s", response)
         return response  # type: ignore
 
 
-def dispatch(
-    socket: socket.socket, protocol: Protocol, transactions: Dict[str, Transaction]
+class _TransactionContext(object):
+    """Register a transaction for the duration of a `with` block."""
+
+    __slots__ = ("conn", "callback", "txn")
+
+    def __init__(
+        self,
+        conn: PhotoshopConnection,
+        callback: Optional[Callable[[Any], None]] = None,
+    ):
+        self.conn = conn
+        self.callback = callback
+        self.txn: Optional[Transaction] = None
+
+    def __enter__(self) -> Transaction:
+        conn = self.conn
+        assert conn.sender is not None
+        txn = Transaction(conn.protocol, conn.sender, next(conn._txn_ids))
+        # Set before the dispatcher can see the transaction, so that nothing
+        # delivered to it is left in the slot.
+        txn.callback = self.callback
+        with conn._txn_lock:
+            conn.transactions[txn.id] = txn
+        self.txn = txn
+        if not conn._dispatching.is_set():
+            self.__exit__(None, None, None)
+            raise AssertionError("Dispatcher is not running.")
+        return txn
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[Any],
+    ) -> None:
+        if isinstance(exc, Exception):
+            logger.error("%s", exc, exc_info=exc)
+        txn = self.txn
+        assert txn is not None
+        with self.conn._txn_lock:
+            logger.debug("Delete txn %d", txn.id)
+            # Asynchronous transactions may be finished from both threads.
+            self.conn.transactions.pop(txn.id, None)
+
+
+class _ResponseStream(object):
+    """
+    Iterator over the next `count` responses of a transaction. The transaction
+    ends when the iterator is exhausted, fails, is closed or is collected,
+    whether or not iteration ever started.
+    """
+
+    __slots__ = ("context", "txn", "remaining", "timeout", "_finalizer", "__weakref__")
+
+    def __init__(
+        self,
+        context: _TransactionContext,
+        txn: Transaction,
+        count: int,
+        timeout: Optional[float],
+    ):
+        self.context = context
+        self.txn = txn
+        self.remaining = count
+        self.timeout = timeout
+        self._finalizer = weakref.finalize(self, context.__exit__, None, None, None)
+
+    def __iter__(self) -> _ResponseStream:
+        return self
+
+    def __next__(self) -> Dict[str, Any]:
+        if self.remaining <= 0:
+            self.close()
+            raise StopIteration
+        try:
+            response = self.txn.receive(timeout=self.timeout)
+        except BaseException as e:
+            if self._finalizer.detach() is not None:
+                self.context.__exit__(type(e), e, e.__traceback__)
+            raise
+        self.remaining -= 1
+        if not self.remaining:
+            self._finalizer()
+        return response
+
+    def close(self) -> None:
+        """End the transaction; further responses are discarded."""
+        self.remaining = 0
+        self._finalizer()
+
+
+def receive_frames(
+    socket: socket.socket,
+    protocol: Protocol,
+    frames: Deque[Any],
+    ready: threading.Event,
 ) -> None:
-    """Receive response and dispatch transactions."""
+    """Read raw frames and hand them over to the dispatch thread."""
     thread = threading.current_thread()
-    logger.debug("%s: Dispatch thread starts." % thread.name)
+    logger.debug("%s: Receive thread starts.", thread.name)
+    reader = SocketReader(socket)
     while True:
         try:
-            response = protocol.receive(socket)
-            if response["content_type"] == ContentType.ILLEGAL:
-                raise RuntimeError("Illegal response: %s" % response)
-            elif response["content_type"] == ContentType.ERROR_STRING:
-                raise RuntimeError(
-                    "Error: %s" % response["body"].decode("utf-8", "ignore")
-                )
-
-            transaction_id = response["transaction"]
-            with Transaction.lock:
-                txn = transactions.get(transaction_id)
-                if not isinstance(txn, Transaction):
-                    raise RuntimeError("Transaction not found: %s" % response)
-                txn.queue.put(response)
+            frames.extend(protocol.read_frames(reader))
         except Exception as e:
-            # If any exception happens, send that to all transaction threads.
-            with Transaction.lock:
-                logger.debug("%s: %s" % (thread.name, e))
-                for txn in transactions.values():
-                    txn.queue.put(e)
+            # Let the dispatch thread handle pending frames before the error.
+            frames.append(e)
             break
-    logger.debug("%s: Dispatch thread terminates." % thread.name)
+        finally:
+            ready.set()
+    logger.debug("%s: Receive thread terminates.", thread.name)
+
+
+def dispatch(
+    frames: Deque[Any],
+    ready: threading.Event,
+    protocol: Protocol,
+    transactions: Dict[int, Transaction],
+    lock: threading.Lock,
+    running: threading.Event,
+) -> None:
+    """Parse received frames and dispatch transactions."""
+    thread = threading.current_thread()
+    logger.debug("%s: Dispatch thread starts.", thread.name)
+    while True:
+        ready.wait()
+        ready.clear()
+        while frames:
+            try:
+                frame = frames.popleft()
+                if isinstance(frame, Exception):
+                    raise frame
+                response = protocol.parse_frame(frame)
+                if (1 << response["content_type"]) & _ERROR_CONTENT_MASK:
+                    if response["content_type"] == ContentType.ILLEGAL:
+                        raise RuntimeError("Illegal response: %s" % response)
+                    raise RuntimeError(
+                        "Error: %s" % response["body"].decode("utf-8", "ignore")
+                    )
+
+                # Single-key dict access is atomic, no need to lock for lookups.
+                txn = transactions.get(response["transaction"])
+                if txn is None:
+                    # Likely a late response to a transaction that timed out.
+                    logger.warning("Transaction not found: %.256s", response)
+                    continue
+                txn.put(response)
+            except Exception as e:
+                # If any exception happens, send that to all transaction threads.
+                logger.debug("%s: %s", thread.name, e)
+                # Clear before the snapshot so that a transaction registered
+                # afterwards sees the flag and fails instead of waiting.
+                running.clear()
+                with lock:
+                    txns = list(transactions.values())
+                for txn in txns:
+                    txn.put(e)
+                logger.debug("%s: Dispatch thread terminates.", thread.name)
+                return
+
+
+def _load_template_sources() -> Dict[str, str]:
+    """Read the script templates shipped in the `api` directory."""
+    directory = os.path.join(os.path.abspath(os.path.dirname(__file__)), "api")
+    sources = {}
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".j2"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                sources[name] = f.read()
+    return sources
+
+
+def _open_script(path: str, file_type: Optional[str], smart_object: bool) -> str:
+    """Format the ExtendScript that opens a document."""
+    return 'open(File("%s"), %s, %s);' % (
+        path,
+        "OpenDocumentType.%s" % file_type if file_type else "undefined",
+        "true" if smart_object else "false",
+    )
+
+
+def _close_socket(sock: socket.socket) -> None:
+    """Shut down the socket so that the receive thread terminates."""
+    logger.debug("Closing the connection.")
+    try:
+        sock.shutdown(socket.SHUT_RDWR)
+    except OSError:
+        pass
+    sock.close()
+
+
+@functools.lru_cache(maxsize=None)
+def _bytecode_cache() -> Optional[FileSystemBytecodeCache]:
+    """
+    Return the cache that persists compiled templates across processes in a
+    per-user temp dir, or `None` if that directory is unusable.
+    """
+    try:
+        # Cache keys only cover the template name and source, so bump the
+        # pattern whenever the environment options change.
+        return FileSystemBytecodeCache(pattern="photoshop-%s-1.cache")
+    except (OSError, RuntimeError) as e:
+        logger.debug("Template bytecode cache disabled: %s", e)
+        return None
+
+
+def _compile_template(
+    env: Environment, name: str, source: str, tree: Optional[nodes.Template] = None
+) -> Template:
+    """
+    Compile the template, going through the bytecode cache if available. An
+    already parsed `tree` of `source` saves parsing it again.
+    """
+    cache = _bytecode_cache()
+    bucket = None
+    if cache is not None:
+        try:
+            bucket = cache.get_bucket(env, name, None, source)
+        except OSError:
+            pass
+    code = bucket.code if bucket is not None else None
+    if code is None:
+        code = env.compile(source if tree is None else tree, name)
+        if cache is not None and bucket is not None:
+            bucket.code = code
+            try:
+                cache.set_bucket(bucket)
+            except OSError:
+                pass
+    return env.template_class.from_code(env, code, env.make_globals(None))
+
+
+@functools.lru_cache(maxsize=256)
+def _render_template(
+    template: Template, items: Tuple[Tuple[str, Any, Any], ...]
+) -> str:
+    """Render template with hashable context items, memoizing the script."""
+    return template.render({key: value for key, _, value in items})
 
 
 class PhotoshopConnection(Kevlar):
@@ -106,6 +393,11 @@ class PhotoshopConnection(Kevlar):
             with PhotoshopConnection(validator=parseScript) as c:
                 c.execute('bad_script +')  # Raises an Error
 
+    :param sndbuf: Socket send buffer size in bytes, default 4 MiB.
+    :param rcvbuf: Socket receive buffer size in bytes, default 4 MiB. Large
+        buffers keep multi-MB uploads and downloads from stalling on the TCP
+        window.
+
     :raise ConnectionRefusedError: if failed to connect to Photoshop.
 
     Example::
@@ -116,12 +408,20 @@ class PhotoshopConnection(Kevlar):
             conn.execute('alert("hi");')
     """
 
+    _sources = _load_template_sources()
     _env = Environment(
-        loader=FileSystemLoader(
-            os.path.join(os.path.abspath(os.path.dirname(__file__)), "api")
-        ),
+        loader=DictLoader(_sources),
         trim_blocks=True,
+        lstrip_blocks=True,
+        # Scripts are ExtendScript, not HTML.
+        autoescape=False,
+        # Templates ship with the package and never change at runtime.
+        auto_reload=False,
+        cache_size=-1,
     )
+    _templates: Dict[str, Template] = {}
+    # Names each template actually references; other context keys are dropped.
+    _variables: Dict[str, FrozenSet[str]] = {}
 
     def __init__(
         self,
@@ -129,23 +429,39 @@ class PhotoshopConnection(Kevlar):
         host: str = "localhost",
         port: int = 49494,
         validator: Optional[Callable[[str], None]] = None,
+        sndbuf: int = 4 << 20,
+        rcvbuf: int = 4 << 20,
     ):
         _password = password or os.getenv("PHOTOSHOP_PASSWORD")
         assert _password is not None
         self.dispatcher: Optional[threading.Thread] = None
+        self._dispatching = threading.Event()
+        self.receiver: Optional[threading.Thread] = None
         self.transactions: Dict[int, Transaction] = dict()
+        # Guards changes to `transactions`; lookups in dispatch are lock-free.
+        self._txn_lock = threading.Lock()
         self.protocol = Protocol(_password)
         self.host = host
         self.port = port
         self.socket: Optional[socket.socket] = None
+        self.sender: Optional[BatchingSendQueue] = None
         self.validator = validator
+        self.sndbuf = sndbuf
+        self.rcvbuf = rcvbuf
         self.lock = threading.Lock()
-        self.subscribers: List[threading.Thread] = []
+        # Active subscriptions, all served by a single event worker thread.
+        self.subscribers: List[_Subscription] = []
+        self._subscription_lock = threading.Lock()
+        self._events: queue.Queue[Tuple[_Subscription, Any]] = queue.Queue()
+        self._event_worker: Optional[threading.Thread] = None
+        self._finalizer: Optional[weakref.finalize] = None
+        if not self._templates:
+            for name in self._sources:
+                self._get_template(name)
+        if validator:
+            validator(self._render("copyAndRemove.js.j2", dict(path="", new_path="")))
         self._reset_connection()
 
-    def __del__(self) -> None:
-        self.close()
-
     def __enter__(self) -> PhotoshopConnection:
         return self
 
@@ -161,65 +477,125 @@ class PhotoshopConnection(Kevlar):
         """
         Close the session.
         """
-        if self.socket:
-            logger.debug("Closing the connection.")
-            try:
-                self.socket.shutdown(socket.SHUT_RDWR)
-            except OSError:
-                pass
-            self.socket.close()
+        if self._finalizer:
+            self._finalizer()
+            self._finalizer = None
             self.socket = None
+            self.sender = None
+        if self.receiver:
+            self.receiver.join()
+            self.receiver = None
         if self.dispatcher:
             self.dispatcher.join()
             self.dispatcher = None
-        for thread in self.subscribers:
-            thread.join()
-        self.subscribers = []
+        # The dispatcher has failed every subscription, so the worker exits.
+        worker = self._event_worker
+        if worker and worker is not threading.current_thread():
+            worker.join()
 
     def _reset_connection(self) -> None:
         logger.debug("Opening the connection.")
         self.close()
         try:
-            Transaction.reset()
             self.transactions = dict()
             self.socket = socket.create_connection((self.host, self.port))
+            # Threads do not reference self, so an unreachable connection is
+            # collected and its socket closed, which stops the threads. Set up
+            # first so that the socket is also closed if configuring it fails.
+            self._finalizer = weakref.finalize(self, _close_socket, self.socket)
+            self._configure_socket(self.socket)
+            self.sender = BatchingSendQueue(self.socket, self.lock)
             self._start_dispatcher()
         except ConnectionRefusedError:
             logger.exception(
                 "Is Photoshop running and configured for remote connection?"
             )
             raise
+        except BaseException:
+            self.close()
+            raise
+
+    def _configure_socket(self, sock: socket.socket) -> None:
+        # Uploads and responses such as download() may be multi-MB.
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.sndbuf)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, self.rcvbuf)
+        # Send short scripts right away instead of waiting for Nagle's timer.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if sys.platform.startswith("linux") and hasattr(socket, "TCP_QUICKACK"):
+            # Only a hint, and not supported by every kernel or socket type.
+            with contextlib.suppress(OSError):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_QUICKACK, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
 
     def _start_dispatcher(self) -> None:
+        frames: Deque[Any] = collections.deque()
+        ready = threading.Event()
+        # A fresh flag per dispatcher, so a terminating one cannot clear it.
+        self._dispatching = threading.Event()
+        self._txn_ids = itertools.count()
+        self._dispatching.set()
+        self.receiver = threading.Thread(
+            target=receive_frames,
+            args=(self.socket, self.protocol, frames, ready),
+            daemon=True,
+        )
         self.dispatcher = threading.Thread(
             target=dispatch,
-            args=(self.socket, self.protocol, self.transactions),
+            args=(
+                frames,
+                ready,
+                self.protocol,
+                self.transactions,
+                self._txn_lock,
+                self._dispatching,
+            ),
             daemon=True,
         )
+        self.receiver.start()
         self.dispatcher.start()
 
-    @contextlib.contextmanager
-    def _transaction(self) -> Iterator[Transaction]:
-        assert self.socket is not None
-        with Transaction.lock:
-            txn = Transaction(self.protocol, self.socket, self.lock)
-            self.transactions[txn.id] = txn
-        try:
-            assert self.dispatcher and self.dispatcher.is_alive()
-            yield txn
-        except Exception as e:
-            logger.exception(e)
-            raise
-        finally:
-            with Transaction.lock:
-                logger.debug("Delete txn %d" % txn.id)
-                del self.transactions[txn.id]
+    def _transaction(
+        self, callback: Optional[Callable[[Any], None]] = None
+    ) -> _TransactionContext:
+        return _TransactionContext(self, callback)
+
+    @classmethod
+    def _get_template(cls, template_file: str) -> Template:
+        """
+        Get the compiled template, loading it on the first access.
+        """
+        template = cls._templates.get(template_file)
+        if template is None:
+            source = cls._sources[template_file]
+            # Parsed once, for both the variable set and the compiled code.
+            tree = cls._env.parse(source, template_file)
+            cls._variables[template_file] = frozenset(
+                meta.find_undeclared_variables(tree)
+            )
+            template = _compile_template(cls._env, template_file, source, tree)
+            cls._templates[template_file] = template
+        return template
 
     def _render(self, template_file: str, context: Dict[str, Any]) -> str:
         """
         Render script template.
         """
-        command = self._env.get_template(template_file).render(context)
+        template = self._get_template(template_file)
+        variables = self._variables[template_file]
+        # The type is part of the key so that e.g. `True` and `1` do not collide.
+        items = tuple(
+            sorted(
+                (key, type(value), value)
+                for key, value in context.items()
+                if key in variables
+            )
+        )
+        try:
+            hash(items)
+        except TypeError:
+            # Unhashable context such as a list of layer settings.
+            return template.render({key: value for key, _, value in items})
+        command = _render_template(template, items)
         # logger.debug('Command:\n%s' % command)
         return command
 
@@ -239,17 +615,174 @@ class PhotoshopConnection(Kevlar):
         """
         if self.validator:
             self.validator(script)
+        return self._execute_unchecked(script, receive_output, timeout)
 
+    def _execute_unchecked(
+        self, script: str, receive_output: bool = False, timeout: Optional[float] = None
+    ) -> Dict[str, Any]:
         with self._transaction() as txn:
             txn.send(ContentType.SCRIPT_SHARED, script.encode("utf-8"))
-            response = txn.receive(timeout=timeout)
+            return self._receive_result(txn, receive_output, timeout)
+
+    def execute_many(
+        self,
+        scripts: Sequence[str],
+        receive_output: bool = False,
+        timeout: Optional[float] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Execute the given ExtendScripts in Photoshop.
 
-            if receive_output:
-                second_response = txn.receive(timeout=timeout)
-                # This is the return value from executeAction().
-                if response.get("body") == b"[ActionDescriptor]":
-                    response = second_response
+        All the scripts are submitted with a single write to the socket, then
+        the responses are collected in order.
+
+        :param scripts: Sequence of ExtendScripts to execute in Photoshop.
+        :param receive_output: Indicates extra return value is returned from
+            Photoshop.
+        :param timeout: Timeout in seconds to wait for each response.
+        :return: `list` of `dict`. See :py:meth:`execute`.
 
+        :raise RuntimeError: if error happens in remote.
+        """
+        if self.validator:
+            for script in scripts:
+                self.validator(script)
+
+        with contextlib.ExitStack() as stack:
+            txns = []
+            for _ in scripts:
+                context = self._transaction()
+                txns.append(context.__enter__())
+                # Unregister without the exception, which is logged once below.
+                stack.callback(context.__exit__, None, None, None)
+            try:
+                for txn, script in zip(txns, scripts):
+                    txn.send(ContentType.SCRIPT_SHARED, script.encode("utf-8"), False)
+                assert self.sender is not None
+                self.sender.flush()
+                return [
+                    self._receive_result(txn, receive_output, timeout) for txn in txns
+                ]
+            except Exception as e:
+                logger.error("%s", e, exc_info=e)
+                raise
+
+    def execute_stream(
+        self, script: str, count: int, timeout: Optional[float] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Execute the given ExtendScript in Photoshop and yield the next `count`
+        responses as they arrive. The script is sent before this returns, and
+        the transaction ends when the iterator is exhausted, closed or dropped.
+
+        :param script: ExtendScript to execute in Photoshop.
+        :param count: number of responses to receive.
+        :param timeout: Timeout in seconds to wait for each response.
+        :return: iterator of `dict`. See :py:meth:`execute`.
+
+        :raise RuntimeError: if error happens in remote.
+        """
+        if self.validator:
+            self.validator(script)
+
+        context = self._transaction()
+        txn = context.__enter__()
+        try:
+            txn.send(ContentType.SCRIPT_SHARED, script.encode("utf-8"))
+        except BaseException as e:
+            context.__exit__(type(e), e, e.__traceback__)
+            raise
+        return _ResponseStream(context, txn, count, timeout)
+
+    def execute_async(
+        self, script: str, receive_output: bool = False
+    ) -> concurrent.futures.Future[Dict[str, Any]]:
+        """
+        Submit the given ExtendScript to Photoshop without waiting for it.
+
+        The returned future is completed by the dispatch thread when the
+        response arrives, so several scripts can be in flight at once. Done
+        callbacks of the future also run in the dispatch thread and must not
+        block.
+
+        :param script: ExtendScript to execute in Photoshop.
+        :param receive_output: Indicates extra return value is returned from
+            Photoshop.
+        :return: :py:class:`concurrent.futures.Future` of the `dict` returned
+            by :py:meth:`execute`.
+
+        Example::
+
+            futures = [conn.execute_async(script) for script in scripts]
+            for future in concurrent.futures.as_completed(futures):
+                print(future.result())
+        """
+        if self.validator:
+            self.validator(script)
+
+        future: concurrent.futures.Future[Dict[str, Any]] = concurrent.futures.Future()
+        responses: List[Dict[str, Any]] = []
+
+        def complete(item: Any) -> None:
+            if future.done():
+                return
+            # Once running, the future can no longer be cancelled under us.
+            if not responses and not future.set_running_or_notify_cancel():
+                return
+            try:
+                responses.append(Transaction.check(item))
+            except Exception as e:
+                future.set_exception(e)
+                return
+            if len(responses) < (2 if receive_output else 1):
+                return
+            response = responses[0]
+            # This is the return value from executeAction().
+            if receive_output and response.get("body") == b"[ActionDescriptor]":
+                response = responses[1]
+            future.set_result(response)
+
+        context = self._transaction(complete)
+        txn = context.__enter__()
+        # Unregister on completion, including cancellation by the caller.
+        future.add_done_callback(lambda _: context.__exit__(None, None, None))
+        try:
+            txn.send(ContentType.SCRIPT_SHARED, script.encode("utf-8"))
+        except BaseException as e:
+            context.__exit__(type(e), e, e.__traceback__)
+            raise
+        return future
+
+    async def aexecute(
+        self, script: str, receive_output: bool = False
+    ) -> Dict[str, Any]:
+        """
+        Execute the given ExtendScript in Photoshop from a coroutine. The
+        awaitable counterpart of :py:meth:`execute_async`, so independent
+        scripts can be pipelined with :py:func:`asyncio.gather`.
+
+        :param script: ExtendScript to execute in Photoshop.
+        :param receive_output: Indicates extra return value is returned from
+            Photoshop.
+        :return: `dict`. See :py:meth:`execute`.
+
+        Example::
+
+            responses = await asyncio.gather(
+                *(conn.aexecute(script) for script in scripts)
+            )
+        """
+        return await asyncio.wrap_future(self.execute_async(script, receive_output))
+
+    def _receive_result(
+        self, txn: Transaction, receive_output: bool, timeout: Optional[float]
+    ) -> Dict[str, Any]:
+        if not receive_output:
+            return txn.receive(timeout=timeout)
+        response, second_response = txn.receive_n(2, timeout=timeout)
+        # This is the return value from executeAction().
+        if response.get("body") == b"[ActionDescriptor]":
+            response = second_response
         return response
 
     def upload(self, data: bytes, suffix: Optional[str] = None) -> str:
@@ -257,7 +790,9 @@ class PhotoshopConnection(Kevlar):
         Upload arbitrary data to Photoshop, and returns the file path where the
         data is saved.
 
-        :param data: `bytes` to send.
+        :param data: `bytes` or other bytes-like object, such as a `memoryview`
+            of a larger buffer, to send. The data is not copied before
+            encryption.
         :param suffix: suffix to append to the temporary file name.
         :return: Temporary server-side file path in `str`.
         :raise RuntimeError: if error happens in remote.
@@ -275,8 +810,9 @@ class PhotoshopConnection(Kevlar):
         path: str = response.get("body", b"").decode("utf-8")
         if suffix:
             new_path = path + suffix
-            self.execute(
-                'var f = File("%s"); f.copy("%s"); f.remove()' % (path, new_path)
+            # The script structure is validated once in __init__.
+            self._execute_unchecked(
+                self._render("copyAndRemove.js.j2", dict(path=path, new_path=new_path))
             )
             path = new_path
         return path
@@ -327,7 +863,7 @@ class PhotoshopConnection(Kevlar):
         :param smart_object: open as a smart object.
         :return: `dict` of response.
         """
-        return self.execute(self._render("open.js.j2", locals()))
+        return self.execute(_open_script(path, file_type, smart_object))
 
     def download(
         self, path: str, file_type: Optional[str] = None, **kwargs: Any
@@ -341,11 +877,10 @@ class PhotoshopConnection(Kevlar):
         :return: `dict`. See return type of
             :py:meth:`~PhotoshopConnection.get_document_stream`
         """
-        smart_object = True
         script = "\n".join(
             (
-                self._render("open.js.j2", locals()),
-                self._render("sendDocumentStreamToNetworkClient.js.j2", locals()),
+                _open_script(path, file_type, True),
+                self._render("sendDocumentStreamToNetworkClient.js.j2", {}),
             )
         )
         logger.debug(script)
@@ -371,8 +906,9 @@ class PhotoshopConnection(Kevlar):
     def subscribe(
         self,
         event: str,
-        callback: Callable[[PhotoshopConnection, Optional[bytes]], bool],
+        callback: Callable[[PhotoshopConnection, Any], bool],
         block: bool = False,
+        latency: float = 0,
         **kwargs: Any,
     ) -> None:
         """
@@ -389,7 +925,16 @@ class PhotoshopConnection(Kevlar):
               Return value of `callback` signals termination of the current
               subscription. If `callback` returns True, subscription stops.
 
+            Callbacks of all the subscriptions of a connection run in a single
+            worker thread, one at a time.
+
         :param block: Block until subscription finishes. default `False`.
+        :param latency: Coalesce events into a single callback, whose `data`
+            is then a `list` of the payloads, delivered at most `latency`
+            seconds after the first pending event. The window is fixed, so a
+            continuous burst such as `imageChanged` while painting still gets
+            a callback every `latency` seconds. default `0`, one callback per
+            event.
 
         Example::
 
@@ -406,41 +951,244 @@ class PhotoshopConnection(Kevlar):
                 time.sleep(5)
         """
         assert callable(callback)
-        thread = threading.Thread(
-            target=listen_event, args=(self, event, callback), daemon=True
+        subscription = _Subscription(self, Event(event), callback, latency)
+        begin = self._render(
+            "networkEventSubscribe.js.j2", dict(event=subscription.event)
         )
-        self.subscribers.append(thread)
-        thread.start()
+        txn = subscription.context.__enter__()
+        with self._subscription_lock:
+            self.subscribers.append(subscription)
+            if self._event_worker is None:
+                self._event_worker = threading.Thread(
+                    target=dispatch_events, args=(self, self._events), daemon=True
+                )
+                self._event_worker.start()
+        try:
+            txn.send(ContentType.SCRIPT_SHARED, begin.encode("utf-8"))
+        except BaseException as e:
+            # The worker reports the error and drops the subscription.
+            txn.put(e)
         if block:
-            thread.join()
+            subscription.finished.wait()
 
+    def _notify(self, subscription: _Subscription, data: Any) -> None:
+        """Run the callback of the subscription, and stop it if requested."""
+        try:
+            done = subscription.callback(self, data)
+        except Exception as e:
+            logger.error("%s", e)
+            self._unsubscribe(subscription, notify_remote=False)
+            return
+        if done:
+            self._unsubscribe(subscription)
+
+    def _unsubscribe(
+        self, subscription: _Subscription, notify_remote: bool = True
+    ) -> None:
+        subscription.context.__exit__(None, None, None)
+
+        def unsubscribed(future: concurrent.futures.Future[Dict[str, Any]]) -> None:
+            try:
+                if future.result().get("body") != b"[ActionDescriptor]":
+                    logger.warning("Unsubscribe failed: %s", subscription.event)
+            except Exception as e:
+                if not isinstance(e, OSError):
+                    logger.error("%s", e)
 
-def listen_event(
-    self: PhotoshopConnection,
-    event: str,
-    callback: Callable[[PhotoshopConnection, Optional[bytes]], bool],
-) -> None:
-    event = Event(event)
-    begin = self._render("networkEventSubscribe.js.j2", dict(event=event))
-    with self._transaction() as txn:
-        txn.send(ContentType.SCRIPT_SHARED, begin.encode("utf-8"))
         try:
-            while True:
-                response = txn.receive()
-                data: bytes = response.get("body")  # type: ignore
-                if data == b"[ActionDescriptor]":
-                    continue
-                lines = data.split(b"\r", 1)
-                assert lines[0].decode("utf-8") == event
-                result = callback(self, lines[1] if len(lines) else None)
-                if result:
-                    break
+            if notify_remote:
+                end = self._render(
+                    "networkEventUnsubscribe.js.j2", dict(event=subscription.event)
+                )
+                # Do not hold up the callbacks of other subscriptions while
+                # Photoshop replies.
+                self.execute_async(end).add_done_callback(unsubscribed)
         except Exception as e:
             if not isinstance(e, OSError):
-                logger.error("%s" % e)
-            return
+                logger.error("%s", e)
+        finally:
+            with self._subscription_lock:
+                self.subscribers.remove(subscription)
+            subscription.finished.set()
+
+
+class _Subscription(object):
+    """Event subscription, driven by the event worker of the connection."""
+
+    __slots__ = ("event", "name", "callback", "latency", "context", "finished")
+
+    def __init__(
+        self,
+        conn: PhotoshopConnection,
+        event: Event,
+        callback: Callable[[PhotoshopConnection, Any], bool],
+        latency: float,
+    ):
+        self.event = event
+        # Event names are compared as bytes, without decoding every event.
+        self.name = event.value.encode("utf-8")
+        self.callback = callback
+        self.latency = latency
+        events = conn._events
+        self.context = conn._transaction(lambda item: events.put((self, item)))
+        self.finished = threading.Event()
+
+    def parse(self, item: Any) -> Any:
+        """
+        Return the payload of a delivered event, or `_ACKNOWLEDGED` for the
+        reply to the subscribe script.
+        """
+        data: bytes = Transaction.check(item)["body"]
+        if data == b"[ActionDescriptor]":
+            return _ACKNOWLEDGED
+        name, separator, payload = data.partition(b"\r")
+        if name != self.name:
+            raise RuntimeError("Unexpected event: %.256r" % data)
+        return payload if separator else None
 
-    end = self._render("networkEventUnsubscribe.js.j2", dict(event=event))
-    with self._transaction() as txn:
-        txn.send(ContentType.SCRIPT_SHARED, end.encode("utf-8"))
-        assert txn.receive().get("body") == b"[ActionDescriptor]"
+
+_ACKNOWLEDGED = object()
+
+
+def dispatch_events(
+    conn: PhotoshopConnection, events: queue.Queue[Tuple[_Subscription, Any]]
+) -> None:
+    """
+    Run the callbacks of every subscription of the connection in one thread,
+    coalescing events of subscriptions with latency. Terminates when no
+    subscription is left.
+    """
+    batches: Dict[_Subscription, List[Any]] = {}
+    deadlines: Dict[_Subscription, float] = {}
+    while True:
+        timeout = None
+        if deadlines:
+            timeout = max(0.0, min(deadlines.values()) - time.monotonic())
+        try:
+            subscription, item = events.get(timeout=timeout)
+        except queue.Empty:
+            pass
+        else:
+            if not subscription.finished.is_set():
+                try:
+                    data = subscription.parse(item)
+                except Exception as e:
+                    if not isinstance(e, OSError):
+                        logger.error("%s", e)
+                    batches.pop(subscription, None)
+                    deadlines.pop(subscription, None)
+                    conn._unsubscribe(subscription, notify_remote=False)
+                else:
+                    if data is _ACKNOWLEDGED:
+                        pass
+                    elif subscription.latency > 0:
+                        batches.setdefault(subscription, []).append(data)
+                        deadlines.setdefault(
+                            subscription, time.monotonic() + subscription.latency
+                        )
+                    else:
+                        conn._notify(subscription, data)
+
+        now = time.monotonic()
+        for subscription in [key for key, value in deadlines.items() if value <= now]:
+            del deadlines[subscription]
+            conn._notify(subscription, batches.pop(subscription))
+
+        with conn._subscription_lock:
+            if not conn.subscribers:
+                conn._event_worker = None
+                return
+
+
+class PhotoshopConnectionPool(Kevlar):
+    """
+    Pool of Photoshop sessions.
+
+    Each call to :py:meth:`execute` goes to the connection with the fewest
+    transactions in flight, so concurrent callers do not contend for a single
+    socket.
+
+    :param size: Number of connections to open, default 2.
+
+    The other parameters, including keyword arguments, are passed to
+    :py:class:`PhotoshopConnection`.
+
+    :raise ConnectionRefusedError: if failed to connect to Photoshop.
+
+    Example::
+
+        from concurrent.futures import ThreadPoolExecutor
+        from photoshop import PhotoshopConnectionPool
+
+        with PhotoshopConnectionPool(password='secret', size=4) as pool:
+            with ThreadPoolExecutor(4) as executor:
+                results = list(executor.map(pool.execute, scripts))
+    """
+
+    def __init__(
+        self,
+        password: Optional[str] = None,
+        host: str = "localhost",
+        port: int = 49494,
+        validator: Optional[Callable[[str], None]] = None,
+        size: int = 2,
+        **kwargs: Any,
+    ):
+        assert size > 0
+        self.connections: List[PhotoshopConnection] = []
+        try:
+            for _ in range(size):
+                self.connections.append(
+                    PhotoshopConnection(password, host, port, validator, **kwargs)
+                )
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self) -> PhotoshopConnectionPool:
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc: Optional[BaseException],
+        traceback: Optional[Any],
+    ) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """
+        Close all the sessions.
+        """
+        for conn in self.connections:
+            conn.close()
+        self.connections = []
+
+    def _acquire(self) -> PhotoshopConnection:
+        return min(self.connections, key=lambda conn: len(conn.transactions))
+
+    def _render(self, template_file: str, context: Dict[str, Any]) -> str:
+        return self.connections[0]._render(template_file, context)
+
+    def execute(
+        self,
+        script: str,
+        receive_output: bool = False,
+        timeout: Optional[float] = None,
+    ) -> Dict[str, Any]:
+        """
+        Execute the given ExtendScript on the least busy connection.
+
+        See :py:meth:`PhotoshopConnection.execute`.
+        """
+        return self._acquire().execute(script, receive_output, timeout)
+
+    def execute_stream(
+        self, script: str, count: int, timeout: Optional[float] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Execute the given ExtendScript on the least busy connection.
+
+        See :py:meth:`PhotoshopConnection.execute_stream`.
+        """
+        return self._acquire().execute_stream(script, count, timeout)
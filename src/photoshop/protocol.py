@@ -1,17 +1,33 @@
 from __future__ import annotations
 
 import enum
-import json
 import logging
 import socket
-from struct import pack, unpack
-from typing import Any, Dict
+import threading
+from struct import Struct
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Union
 
 from photoshop.crypto import EncryptDecrypt
 from PIL import Image
 
 logger = logging.getLogger(__name__)
 
+try:
+    # orjson parses bytes directly and is much faster on multi-MB documents.
+    from orjson import loads as _loads
+except ImportError:
+    # The standard json module decodes bytes input as UTF-8 by itself.
+    from json import loads as _loads  # type: ignore
+
+
+def json_loads(data: bytes) -> Any:
+    """Parse JSON `bytes`, with orjson when it is installed."""
+    return _loads(data)
+
+
+# Maximum number of buffers passed to a single sendmsg() call.
+_IOV_MAX = 1024
+
 
 class ContentType(enum.IntEnum):
     """
@@ -31,6 +47,19 @@ class ContentType(enum.IntEnum):
     SCRIPT_SHARED = 10
 
 
+_CONTENT_TYPES = {member.value: member for member in ContentType}
+
+# Precompiled layouts: length or status, frame header (length, status),
+# message header (version, transaction, content type) and pixmap header.
+_UINT32 = Struct(">I")
+_FRAME_HEADER = Struct(">2I")
+_MESSAGE_HEADER = Struct(">3I")
+_PIXMAP_HEADER = Struct(">3I3B")
+
+# Frames up to this size are decrypted into a reused scratch buffer.
+_SCRATCH_LIMIT = 1 << 20
+
+
 class Pixmap(object):
     """
     Pixmap representing an uncompressed pixels, ARGB, row-major order.
@@ -41,7 +70,8 @@ class Pixmap(object):
     :ivar color_mode: color mode of the image.
     :ivar channels: number of channels.
     :ivar bits: bits per pixel.
-    :ivar data: raw data bytes.
+    :ivar data: raw data, `bytes` or a read-only `memoryview` into the
+        response body when parsed from Photoshop.
     """
 
     def __init__(
@@ -65,13 +95,13 @@ class Pixmap(object):
     @classmethod
     def parse(cls, data: bytes) -> Pixmap:
         """Parse Pixmap from data."""
-        assert len(data) >= 14
-        return cls(*(unpack(">3I3B", data[:15]) + (data[15:],)))
+        if len(data) < _PIXMAP_HEADER.size:
+            raise ValueError("Pixmap too short: %d bytes" % len(data))
+        return cls(*(_PIXMAP_HEADER.unpack_from(data) + (data[15:],)))
 
     def dump(self) -> bytes:
         """Dump Pixmap to bytes."""
-        header = pack(
-            ">3I3B",
+        header = _PIXMAP_HEADER.pack(
             self.width,
             self.height,
             self.row_bytes,
@@ -89,16 +119,133 @@ class Pixmap(object):
             "RGBA", (self.width, self.height), self.data, "raw", "ARGB", 0, 1
         )
 
+    def numpy(self) -> Any:
+        """
+        Convert to a `numpy.ndarray` of shape (height, width, channels), in
+        ARGB order for 4-channel pixmaps. The array is a read-only view of
+        `data`; no pixels are copied.
+
+        Requires `numpy`, an optional dependency that is not installed with
+        this package.
+
+        :raise ValueError: if the pixmap is not 8 bits per channel, or `data`
+            does not hold the rows described by the header.
+        """
+        import numpy as np  # type: ignore
+
+        if self.bits != 8:
+            raise ValueError("Unsupported bits per channel: %d" % self.bits)
+        pixel_bytes = self.width * self.channels
+        if self.row_bytes < pixel_bytes or len(self.data) < (
+            self.row_bytes * (self.height - 1) + pixel_bytes if self.height else 0
+        ):
+            raise ValueError(
+                "Pixmap data does not match the layout: %dx%d, %d channels, "
+                "%d bytes per row, %d bytes"
+                % (
+                    self.width,
+                    self.height,
+                    self.channels,
+                    self.row_bytes,
+                    len(self.data),
+                )
+            )
+        return np.ndarray(
+            (self.height, self.width, self.channels),
+            dtype=np.uint8,
+            buffer=self.data,
+            strides=(self.row_bytes, self.channels, 1),
+        )
+
     def __repr__(self) -> str:
         return "Pixmap(width=%d, height=%d, color=%d, bits=%d, data=%r)" % (
             self.width,
             self.height,
             self.color_mode,
             self.bits,
-            self.data if len(self.data) < 12 else self.data[:12] + b"...",
+            bytes(self.data) if len(self.data) < 12 else bytes(self.data[:12]) + b"...",
         )
 
 
+class SocketReader(object):
+    """
+    Buffered socket reader.
+
+    Serves `recv_into` from a persistent buffer refilled with up to
+    `buffer_size` bytes per system call, so consecutive frames that arrive in
+    one TCP segment are read without further syscalls. Reads larger than the
+    buffer go straight to the socket.
+
+    :param socket: socket to receive data.
+    :param buffer_size: size of the read-ahead buffer, default 64 KiB.
+    """
+
+    def __init__(self, socket: socket.socket, buffer_size: int = 64 << 10):
+        self.socket = socket
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._start = 0
+        self._end = 0
+
+    def peek(self) -> memoryview:
+        """Return the bytes already buffered, without consuming them."""
+        return self._view[self._start : self._end]
+
+    def recv_into(self, buffer: memoryview, nbytes: int = 0) -> int:
+        nbytes = nbytes or len(buffer)
+        available = self._end - self._start
+        if not available:
+            if nbytes >= len(self._buffer):
+                return self.socket.recv_into(buffer, nbytes)
+            self._start = 0
+            self._end = available = self.socket.recv_into(self._view)
+            if not available:
+                return 0
+        nbytes = min(nbytes, available)
+        buffer[:nbytes] = self._view[self._start : self._start + nbytes]
+        self._start += nbytes
+        return nbytes
+
+
+def _recv_exact(socket: Union[socket.socket, SocketReader], size: int) -> bytearray:
+    """Receive exactly `size` bytes into a preallocated buffer."""
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    offset = 0
+    while offset < size:
+        nbytes = socket.recv_into(view[offset:], size - offset)
+        if not nbytes:
+            if offset == 0:
+                raise ConnectionError("Empty response, likely connection closed.")
+            raise ConnectionError(
+                "Expected %d bytes, received %d bytes, password incorrect?"
+                % (size, offset)
+            )
+        offset += nbytes
+    return buffer
+
+
+def sendmsg_all(socket: socket.socket, buffers: Sequence[bytes]) -> None:
+    """
+    Send all the buffers with scatter/gather I/O, resuming on partial sends.
+
+    Falls back to a single `sendall` of the joined buffers on platforms where
+    sockets lack `sendmsg`.
+    """
+    if not hasattr(socket, "sendmsg"):
+        socket.sendall(b"".join(buffers))
+        return
+    views = [memoryview(buffer) for buffer in buffers]
+    index = 0
+    while index < len(views):
+        sent = socket.sendmsg(views[index : index + _IOV_MAX])
+        while index < len(views) and sent >= len(views[index]):
+            sent -= len(views[index])
+            index += 1
+        if sent:
+            views[index] = views[index][sent:]
+
+
 class Protocol(object):
     """
     Photoshop protocol.
@@ -108,6 +255,41 @@ class Protocol(object):
 
     def __init__(self, password: str):
         self.enc = EncryptDecrypt(password.encode("ascii"))
+        # Decryption scratch space reused across frames, see _get_scratch.
+        self._scratch = bytearray(256)
+        self._scratch_lock = threading.Lock()
+        # Body parsers by content type; other types are returned as bytes.
+        self._parsers: Dict[int, Callable[[bytes], Dict[str, Any]]] = {
+            ContentType.IMAGE: self._parse_image,
+            ContentType.FILE_STREAM: self._parse_file_stream,
+        }
+
+    def pack(
+        self,
+        content_type: ContentType,
+        data: bytes,
+        transaction: int = 0,
+        status: int = 0,
+    ) -> bytes:
+        """
+        Packs data into an encrypted message frame.
+
+        :param content_type: See :py:class:`.ContentType`.
+        :param data: `bytes` or other bytes-like object to send.
+        :param transaction: transaction id.
+        :param status: execution status, should be 0.
+        :return: `bytes` of the framed message.
+        """
+        header = _MESSAGE_HEADER.pack(self.VERSION, transaction, content_type)
+        size = self.enc.encrypted_size(len(header) + len(data))
+        frame = bytearray(8 + size + self.enc.block_size - 1)
+        _FRAME_HEADER.pack_into(frame, 0, 4 + size, status)
+        # Large payloads such as upload() data are encrypted in place, never
+        # copied into an intermediate plaintext buffer.
+        self.enc.encrypt_into(data, frame, 8, header)
+        del frame[8 + size :]
+        logger.debug("Packing %d bytes (total %d bytes)", 4 + size, len(frame))
+        return frame
 
     def send(
         self,
@@ -125,12 +307,29 @@ class Protocol(object):
         :param transaction: transaction id.
         :param status: execution status, should be 0.
         """
-        body = pack(">3I", self.VERSION, transaction, content_type) + data
-        encrypted = self.enc.encrypt(body)
-        length = 4 + len(encrypted)
-        data = pack(">2I", length, status) + encrypted
-        logger.debug("Sending %d bytes (total %d bytes)" % (length, len(data)))
-        socket.sendall(data)
+        socket.sendall(self.pack(content_type, data, transaction, status))
+
+    def send_many(
+        self,
+        socket: socket.socket,
+        messages: Sequence[Tuple[ContentType, bytes]],
+        transaction: int = 0,
+        status: int = 0,
+    ) -> None:
+        """
+        Sends several messages to Photoshop in a single scatter/gather write.
+
+        :param messages: sequence of `(content_type, data)` pairs.
+        :param transaction: transaction id.
+        :param status: execution status, should be 0.
+        """
+        sendmsg_all(
+            socket,
+            [
+                self.pack(content_type, data, transaction, status)
+                for content_type, data in messages
+            ],
+        )
 
     def receive(self, socket: socket.socket) -> Dict[str, Any]:
         """
@@ -156,64 +355,119 @@ class Protocol(object):
                 'body': b'[ActionDescriptor]'
             }
 
-        :raise AssertionError: if response format is invalid.
+        :raise ValueError: if response format is invalid.
 
         """
-        length_bytes = socket.recv(4)
-        if len(length_bytes) != 4:
-            raise ConnectionError("Empty response, likely connection closed.")
-        length: int = unpack(">I", length_bytes)[0]
-        assert length >= 4, "length = %d" % length
-        body = socket.recv(length)
-        assert (
-            len(body) == length
-        ), "Expected %d bytes, received %d bytes, password incorrect?" % (
-            length,
-            len(body),
-        )
-        status = unpack(">I", body[:4])[0]
-        logger.debug("%d bytes returned, status = %d" % (length, status))
-        body = body[4:]
+        return self.parse_frame(self.read_frame(socket))
+
+    def read_frame(self, socket: Union[socket.socket, SocketReader]) -> bytes:
+        """
+        Reads a raw message frame from Photoshop without decrypting it.
+
+        :param socket: socket or :py:class:`SocketReader` to receive data.
+        :return: `bytes` of the status and the encrypted body.
+        """
+        length_bytes = _recv_exact(socket, 4)
+        length: int = _UINT32.unpack(length_bytes)[0]
+        if length < 4:
+            raise ValueError("Invalid frame length: %d" % length)
+        return _recv_exact(socket, length)
+
+    def read_frames(self, reader: SocketReader) -> List[bytes]:
+        """
+        Reads a raw message frame, then every further frame that is already
+        complete in the buffer of `reader`, without blocking again.
+
+        :param reader: :py:class:`SocketReader` to receive data.
+        :return: `list` of frames. See :py:meth:`read_frame`.
+        """
+        frames = [self.read_frame(reader)]
+        while True:
+            buffered = reader.peek()
+            size = len(buffered)
+            if size < 4 or size < 4 + _UINT32.unpack_from(buffered)[0]:
+                return frames
+            frames.append(self.read_frame(reader))
+
+    def parse_frame(self, body: bytes) -> Dict[str, Any]:
+        """
+        Parses a raw message frame returned by :py:meth:`read_frame`.
+
+        :param body: `bytes` of the status and the encrypted body.
+        :return: `dict`. See :py:meth:`receive`.
+        :raise ValueError: if response format is invalid.
+        """
+        length = len(body)
+        status = _UINT32.unpack_from(body)[0]
+        logger.debug("%d bytes returned, status = %d", length, status)
 
         if status:
             raise ValueError(
                 "status = %d: likely incorrect password: %r"
-                % (
-                    status,
-                    body[: min(12, len(body))] + (b"" if len(body) <= 12 else b"..."),
-                )
+                % (status, bytes(body[4:16]) + (b"" if length <= 16 else b"..."))
             )
 
-        data = self.enc.decrypt(body)
-        assert len(data) >= 12
-        protocol, transaction, content_type = unpack(">3I", data[:12])
-        assert protocol == self.VERSION
-        result: Any = data[12:]
-        if content_type == ContentType.IMAGE:
-            result = self._parse_image(result)
-        elif content_type == ContentType.FILE_STREAM:
-            result = self._parse_file_stream(result)
+        # Decrypt straight from the frame into the scratch buffer, and copy
+        # only the message body out of it.
+        with self._scratch_lock:
+            data = self._get_scratch(length - 4 + self.enc.block_size - 1)
+            with memoryview(body) as view:
+                size = self.enc.decrypt_into(view[4:], data)
+            if size < 12:
+                raise ValueError("Message too short: %d bytes" % size)
+            protocol, transaction, content_type = _MESSAGE_HEADER.unpack_from(data)
+            result: Any
+            if data is not self._scratch and content_type == ContentType.FILE_STREAM:
+                # One-off buffers are not reused, so large streams stay in place.
+                result = memoryview(data)[12:size]
+            else:
+                with memoryview(data) as view:
+                    result = bytes(view[12:size])
+        if protocol != self.VERSION:
+            raise ValueError("Unsupported protocol version: %d" % protocol)
+        member = _CONTENT_TYPES.get(content_type)
+        if member is None:
+            raise ValueError("Unknown content type: %d" % content_type)
+        parser = self._parsers.get(content_type)
+        if parser is not None:
+            result = parser(result)
 
         return dict(
             status=status,
             protocol=protocol,
             transaction=transaction,
-            content_type=ContentType(content_type),
+            content_type=member,
             body=result,
         )
 
+    def _get_scratch(self, size: int) -> bytearray:
+        """
+        Return a buffer of at least `size` bytes. The shared buffer grows to
+        fit but is never shrunk; large frames such as downloads get a one-off
+        buffer so that they do not pin memory.
+        """
+        if size > _SCRATCH_LIMIT:
+            return bytearray(size)
+        if len(self._scratch) < size:
+            self._scratch = bytearray(size)
+        return self._scratch
+
     def _parse_image(self, data: bytes) -> Dict[str, Any]:
-        assert len(data) > 0
+        if not data:
+            raise ValueError("Empty image response.")
         image_type = data[0]
         if image_type == 1:
             return dict(image_type=image_type, data=data[1:])
         elif image_type == 2:
-            return dict(image_type=image_type, data=Pixmap.parse(data[1:]))
+            # Pixels are not copied out of the body; the pixmap keeps a view.
+            return dict(image_type=image_type, data=Pixmap.parse(memoryview(data)[1:]))
         raise ValueError("Unsupported image type: %d" % image_type)
 
     def _parse_file_stream(self, data: bytes) -> Dict[str, Any]:
-        assert len(data) >= 4
-        length: int = unpack(">I", data[:4])[0]
-        info = json.loads(data[4 : length + 4].decode("utf-8"))
-        info["data"] = data[4 + length :]
+        if len(data) < 4:
+            raise ValueError("FileStream too short: %d bytes" % len(data))
+        length: int = _UINT32.unpack_from(data)[0]
+        info = json_loads(bytes(data[4 : length + 4]))
+        # The stream can be up to 2 GB, so it is not copied out of the body.
+        info["data"] = memoryview(data)[4 + length :]
         return info  # type: ignore
@@ -1,5 +1,8 @@
 import contextlib
+import functools
+import json
 import logging
+import re
 import socket
 import threading
 import time
@@ -35,9 +38,18 @@ FILE_STREAM_RESPONSE = (
     b"\x01p^x|\x06\x80&\xafqm\x07\x17\x9f\xa9qr%\x93\xc2^\x0087Y\x03@\xefV\xd2"
     b"\xf8-\xff[\xbe\x00\xc8\xecJ\x9e\x97kYc\x00\x00\x00\x00IEND\xaeB`\x82"
 )
+_FILE_STREAM_LENGTH = int.from_bytes(FILE_STREAM_RESPONSE[:4], "big")
+FILE_STREAM_INFO = json.loads(FILE_STREAM_RESPONSE[4 : 4 + _FILE_STREAM_LENGTH])
+FILE_STREAM_DATA = FILE_STREAM_RESPONSE[4 + _FILE_STREAM_LENGTH :]
 ACKNOWLEDGE = b"[ActionDescriptor]"
 
 
+@functools.lru_cache(maxsize=256)
+def parse_script(body: bytes) -> Any:
+    """Parse a request script; tests send the same scripts many times."""
+    return parseScript(body.decode("utf-8"))
+
+
 class PhotoshopHandler(BaseRequestHandler):
     def setup(self) -> None:
         self.protocol = Protocol(PASSWORD)
@@ -64,7 +76,7 @@ class PhotoshopHandler(BaseRequestHandler):
         content_type = request.get("content_type")
         if content_type in (ContentType.SCRIPT, ContentType.SCRIPT_SHARED):
             try:
-                parseScript(request["body"].decode("utf-8"))
+                parse_script(request["body"])
             except ParseError as e:
                 logger.exception("%s: %r" % (e, request["body"]))
                 return b""
@@ -76,6 +88,14 @@ class PhotoshopHandler(BaseRequestHandler):
         return body or b""
 
 
+class FragmentedHandler(PhotoshopHandler):
+    def send_script(self, transaction: int, body: bytes = b"") -> None:
+        frame = self.protocol.pack(ContentType.SCRIPT, body, transaction)
+        for i in range(0, len(frame), 5):
+            self.request.sendall(frame[i : i + 5])
+            time.sleep(0.001)
+
+
 class ScriptOutputHandler(PhotoshopHandler):
     def do_handle(self, request: Dict[str, Any]) -> None:
         super(ScriptOutputHandler, self).do_handle(request)
@@ -83,13 +103,16 @@ class ScriptOutputHandler(PhotoshopHandler):
 
 
 class SubscribeHandler(PhotoshopHandler):
+    # Seconds between events; only their order matters to the client.
+    INTERVAL = 0.01
+
     def do_handle(self, request: Dict[str, Any]) -> None:
         self.send_script(request["transaction"], ACKNOWLEDGE)
-        script = parseScript(request["body"].decode("utf-8"))
+        script = parse_script(request["body"])
         command = script.body[0].declarations[0].init.arguments[0].value
         if command == "networkEventSubscribe":
             for _ in range(3):
-                time.sleep(1.0)
+                time.sleep(self.INTERVAL)
                 self.send_script(request["transaction"], b"imageChanged\r{}")
 
 
@@ -103,14 +126,51 @@ class JPEGHandler(PhotoshopHandler):
 class PixmapHandler(PhotoshopHandler):
     def do_handle(self, request: Dict[str, Any]) -> None:
         data = b"\x02" + Pixmap(2, 2, 8, 3, 3, 8, b"\x00" * 16).dump()
-        self.protocol.send(self.request, ContentType.IMAGE, data)
-        self.send_script(request["transaction"], ACKNOWLEDGE)
+        self.protocol.send_many(
+            self.request,
+            [(ContentType.IMAGE, data), (ContentType.SCRIPT, ACKNOWLEDGE)],
+            request["transaction"],
+        )
+
+
+class BatchPixmapHandler(PhotoshopHandler):
+    def do_handle(self, request: Dict[str, Any]) -> None:
+        data = b"\x02" + Pixmap(2, 2, 8, 3, 3, 8, b"\x00" * 16).dump()
+        count = request["body"].count(b"executeAction(")
+        self.protocol.send_many(
+            self.request,
+            [(ContentType.IMAGE, data)] * count + [(ContentType.SCRIPT, ACKNOWLEDGE)],
+            request["transaction"],
+        )
 
 
 class FileStreamHandler(PhotoshopHandler):
     def do_handle(self, request: Dict[str, Any]) -> None:
-        self.protocol.send(self.request, ContentType.FILE_STREAM, FILE_STREAM_RESPONSE)
-        self.send_script(request["transaction"], ACKNOWLEDGE)
+        position = self.get_large_integer(request["body"], "position") or 0
+        size = self.get_large_integer(request["body"], "size")
+        data = FILE_STREAM_DATA[position:][:size]
+        header = json.dumps(
+            dict(
+                FILE_STREAM_INFO,
+                position=position,
+                size=len(data),
+                fullSize=len(FILE_STREAM_DATA),
+            )
+        ).encode("utf-8")
+        body = len(header).to_bytes(4, "big") + header + data
+        self.protocol.send_many(
+            self.request,
+            [(ContentType.FILE_STREAM, body), (ContentType.SCRIPT, ACKNOWLEDGE)],
+            request["transaction"],
+        )
+
+    @staticmethod
+    def get_large_integer(script: bytes, key: str) -> Optional[int]:
+        match = re.search(
+            rb'putLargeInteger\(stringIDToTypeID\("%s"\), (\d+)\)' % key.encode(),
+            script,
+        )
+        return int(match.group(1)) if match else None
 
 
 class IllegalHandler(PhotoshopHandler):
@@ -132,6 +192,11 @@ class ErrorImageHandler(PhotoshopHandler):
         )
 
 
+class SilentHandler(PhotoshopHandler):
+    def do_handle(self, request: Dict[str, Any]) -> None:
+        pass
+
+
 class ErrorHandler(BaseRequestHandler):
     def handle(self) -> None:
         self.request.recv(1024)
@@ -160,11 +225,19 @@ class ErrorTransactionHandler(PhotoshopHandler):
         )
 
 
+class MockServer(ThreadingTCPServer):
+    allow_reuse_address = True
+    request_queue_size = 32
+    # Do not wait for handlers that are still sleeping on shutdown.
+    daemon_threads = True
+    block_on_close = False
+
+
 @contextlib.contextmanager
 def serve(
     handler: Callable[..., BaseRequestHandler]
 ) -> Iterator[Tuple[Optional[str], int]]:
-    server = ThreadingTCPServer(("localhost", 0), handler)
+    server = MockServer(("localhost", 0), handler)
     thread = threading.Thread(target=server.serve_forever, daemon=True)
     thread.start()
     yield server.server_address
@@ -172,79 +245,97 @@ def serve(
     server.server_close()
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def script_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(PhotoshopHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def fragmented_server() -> Iterator[Tuple[Optional[str], int]]:
+    with serve(FragmentedHandler) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
 def script_output_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(ScriptOutputHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def subscribe_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(SubscribeHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def jpeg_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(JPEGHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def pixmap_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(PixmapHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def batch_pixmap_server() -> Iterator[Tuple[Optional[str], int]]:
+    with serve(BatchPixmapHandler) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
 def filestream_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(FileStreamHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def illegal_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(IllegalHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
+def silent_server() -> Iterator[Tuple[Optional[str], int]]:
+    with serve(SilentHandler) as server:
+        yield server
+
+
+@pytest.fixture(scope="session")
 def error_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(ErrorHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_image_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(ErrorImageHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_string_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(ErrorStringHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_status_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(ErrorStatusHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_connection_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(ErrorConnectionHandler) as server:
         yield server
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_transaction_server() -> Iterator[Tuple[Optional[str], int]]:
     with serve(ErrorTransactionHandler) as server:
         yield server
@@ -259,3 +350,8 @@ def test_error_server(error_server: Tuple[Optional[str], int]) -> None:
 @pytest.fixture
 def password() -> str:
     return PASSWORD
+
+
+@pytest.fixture
+def file_stream_data() -> bytes:
+    return FILE_STREAM_DATA
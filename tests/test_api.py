@@ -1,7 +1,10 @@
-from typing import Optional, Tuple
+import io
+from typing import Any, List, Optional, Tuple
 
+import pytest
 from esprima import parseScript
 from photoshop import PhotoshopConnection
+from photoshop.api import _layer_shape_script
 from photoshop.protocol import Pixmap
 
 
@@ -24,6 +27,39 @@ def test_subscribe(password: str, subscribe_server: Tuple[Optional[str], int]) -
         conn.subscribe("imageChanged", CallbackHandler(), block=True)
 
 
+def test_subscribe_shared_worker(
+    password: str, subscribe_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnection(
+        password, port=subscribe_server[1], validator=parseScript
+    ) as conn:
+        handlers = [CallbackHandler(), CallbackHandler()]
+        for handler in handlers:
+            conn.subscribe("imageChanged", handler)
+        worker = conn._event_worker
+        assert worker is not None
+        assert len(conn.subscribers) == 2
+        worker.join(timeout=30)
+        assert conn.subscribers == []
+        assert [handler.count for handler in handlers] == [3, 3]
+
+
+def test_subscribe_latency(
+    password: str, subscribe_server: Tuple[Optional[str], int]
+) -> None:
+    batches: List[Any] = []
+
+    def handler(conn: PhotoshopConnection, data: Any) -> bool:
+        batches.append(data)
+        return True
+
+    with PhotoshopConnection(
+        password, port=subscribe_server[1], validator=parseScript
+    ) as conn:
+        conn.subscribe("imageChanged", handler, block=True, latency=0.5)
+    assert batches == [[b"{}", b"{}", b"{}"]]
+
+
 def test_subscribe_error(
     password: str, error_status_server: Tuple[Optional[str], int]
 ) -> None:
@@ -53,6 +89,43 @@ def test_get_layer_thumbnail(
         assert isinstance(pixmap, Pixmap)
 
 
+def test_get_layer_thumbnails(
+    password: str, batch_pixmap_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnection(
+        password, port=batch_pixmap_server[1], validator=parseScript
+    ) as conn:
+        requests = [{}, dict(layer=1), dict(max_width=64, max_height=64)]
+        pixmaps = list(conn.get_layer_thumbnails(requests))
+        assert len(pixmaps) == 3
+        assert all(isinstance(pixmap, Pixmap) for pixmap in pixmaps)
+
+        # The script is sent right away; stopping early ends the transaction.
+        iterator = conn.get_layer_thumbnails(requests)
+        assert len(conn.transactions) == 1
+        assert isinstance(next(iterator), Pixmap)
+        del iterator
+        assert conn.transactions == {}
+        iterator = conn.get_layer_thumbnails(requests)
+        assert len(conn.transactions) == 1
+        del iterator
+        assert conn.transactions == {}
+
+
+@pytest.mark.parametrize(
+    "args",
+    [
+        (None, None, "1.0.0", None),
+        ("1", 3, "1.1", ["a", "b"]),
+        (None, (1, 6), "1.0", []),
+    ],
+)
+def test_layer_shape_script(args: Tuple[Any, ...]) -> None:
+    script = _layer_shape_script(*args)
+    parseScript(script)
+    assert script.endswith("executeAction(idNS, desc1, DialogModes.NO);")
+
+
 def test_get_layer_shape(
     password: str, script_output_server: Tuple[Optional[str], int]
 ) -> None:
@@ -81,3 +154,28 @@ def test_get_document_stream(
     ) as conn:
         document_info = conn.get_document_stream()
         assert isinstance(document_info, dict)
+        assert bytes(document_info["data"]).startswith(b"\x89PNG")
+
+
+def test_get_document_stream_into(
+    password: str,
+    filestream_server: Tuple[Optional[str], int],
+    file_stream_data: bytes,
+) -> None:
+    with PhotoshopConnection(
+        password, port=filestream_server[1], validator=parseScript
+    ) as conn:
+        sink = io.BytesIO()
+        assert conn.get_document_stream_into(sink, chunk_size=100) == 378
+        assert sink.getvalue() == file_stream_data
+        info = conn.get_document_stream(position=300, size=100)
+        assert (info["position"], info["size"], info["fullSize"]) == (300, 78, 378)
+        assert info["data"] == file_stream_data[300:]
+
+
+def test_unexpected_content_type(
+    password: str, jpeg_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnection(password, port=jpeg_server[1]) as conn:
+        with pytest.raises(RuntimeError):
+            conn.get_document_info()
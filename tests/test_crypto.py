@@ -1,3 +1,4 @@
+import pytest
 from photoshop.crypto import EncryptDecrypt
 
 PASSWORD = b"lei6ooH6ieyeenga"
@@ -27,3 +28,32 @@ def test_encrypt_decrypt() -> None:
     f = EncryptDecrypt(PASSWORD)
     assert f.encrypt(DECRYPTED) == ENCRYPTED
     assert f.decrypt(ENCRYPTED) == DECRYPTED
+
+
+def test_encrypt_into() -> None:
+    f = EncryptDecrypt(PASSWORD)
+    size = f.encrypted_size(len(DECRYPTED))
+    assert size == len(ENCRYPTED)
+    buffer = bytearray(4 + size + f.block_size - 1)
+    assert f.encrypt_into(DECRYPTED, buffer, 4) == size
+    assert buffer[4 : 4 + size] == ENCRYPTED
+
+
+def test_decrypt_into() -> None:
+    f = EncryptDecrypt(PASSWORD)
+    buffer = bytearray(len(ENCRYPTED) + f.block_size - 1)
+    size = f.decrypt_into(ENCRYPTED, buffer)
+    assert buffer[:size] == DECRYPTED
+
+
+def test_encrypt_into_header() -> None:
+    f = EncryptDecrypt(PASSWORD)
+    buffer = bytearray(len(ENCRYPTED) + f.block_size - 1)
+    f.encrypt_into(DECRYPTED[12:], buffer, 0, DECRYPTED[:12])
+    assert buffer[: len(ENCRYPTED)] == ENCRYPTED
+
+
+def test_decrypt_invalid_padding() -> None:
+    f = EncryptDecrypt(PASSWORD)
+    with pytest.raises(ValueError):
+        f.decrypt(ENCRYPTED[:-8])
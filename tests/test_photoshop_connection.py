@@ -1,8 +1,18 @@
-from typing import Optional, Tuple
+import asyncio
+import gc
+import queue
+import socket
+from typing import Any, Dict, List, Optional, Tuple
 
 import pytest
 from esprima import parseScript
-from photoshop import PhotoshopConnection
+from photoshop import PhotoshopConnection, PhotoshopConnectionPool
+from photoshop import photoshop_connection
+from photoshop.photoshop_connection import (
+    _bytecode_cache,
+    _compile_template,
+    _open_script,
+)
 from photoshop.protocol import ContentType, Pixmap
 
 SCRIPT = """
@@ -25,7 +35,31 @@ def test_connection_script(
     assert response["transaction"] == 0
     assert response["content_type"] == ContentType.SCRIPT
     assert response["body"] == b"{}"
-    conn.__del__()  # This is not elegant.
+    conn.close()
+
+
+def test_connection_finalize(
+    password: str, script_server: Tuple[Optional[str], int]
+) -> None:
+    conn = PhotoshopConnection(password, port=script_server[1])
+    sock = conn.socket
+    assert sock is not None
+    del conn
+    gc.collect()
+    assert sock.fileno() == -1
+
+
+def test_connection_pool(
+    password: str, script_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnectionPool(
+        password, port=script_server[1], size=2, sndbuf=1 << 20
+    ) as pool:
+        assert len(pool.connections) == 2
+        for _ in range(4):
+            response = pool.execute('alert("hi")')
+            assert response["body"] == b"{}"
+    assert pool.connections == []
 
 
 def test_connection_jpeg(password: str, jpeg_server: Tuple[Optional[str], int]) -> None:
@@ -50,6 +84,14 @@ def test_connection_pixmap(
         assert isinstance(response["body"]["data"], Pixmap)
 
 
+def test_connection_fragmented(
+    password: str, fragmented_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnection(password, port=fragmented_server[1]) as conn:
+        response = conn.execute('alert("hi")')
+        assert response["body"] == b"{}"
+
+
 def test_connection_refused(password: str) -> None:
     with pytest.raises(ConnectionRefusedError):
         PhotoshopConnection(password, host="localhost", port=23)
@@ -99,13 +141,18 @@ def test_error_transaction(
     password: str, error_transaction_server: Tuple[Optional[str], int]
 ) -> None:
     with PhotoshopConnection(password, port=error_transaction_server[1]) as conn:
-        with pytest.raises(RuntimeError):
-            conn.execute(SCRIPT)
+        with pytest.raises(queue.Empty):
+            conn.execute(SCRIPT, timeout=0.1)
+        # Unknown transactions are dropped without stopping the dispatcher.
+        assert conn._dispatching.is_set()
 
 
 def test_upload(password: str, script_server: Tuple[Optional[str], int]) -> None:
-    with PhotoshopConnection(password, port=script_server[1]) as conn:
+    with PhotoshopConnection(
+        password, port=script_server[1], validator=parseScript
+    ) as conn:
         conn.upload(b"\x00\x00\x00\x00", suffix=".dat")
+        conn.upload(memoryview(bytearray(4)))
 
 
 def test_download(
@@ -134,3 +181,181 @@ def test_open_document(
         password, port=script_server[1], validator=parseScript
     ) as conn:
         conn.open_document("filename.psd", file_type=file_type)
+
+
+def test_execute_many(password: str, script_server: Tuple[Optional[str], int]) -> None:
+    with PhotoshopConnection(
+        password, port=script_server[1], validator=parseScript
+    ) as conn:
+        responses = conn.execute_many(['alert("hi")'] * 3)
+        assert len(responses) == 3
+        for response in responses:
+            assert response["content_type"] == ContentType.SCRIPT
+            assert response["body"] == b"{}"
+
+
+def test_execute_many_error(
+    password: str,
+    error_status_server: Tuple[Optional[str], int],
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    with PhotoshopConnection(password, port=error_status_server[1]) as conn:
+        with pytest.raises(ValueError):
+            conn.execute_many(['alert("hi")'] * 3)
+        assert conn.transactions == {}
+    errors = [record for record in caplog.records if record.levelname == "ERROR"]
+    assert len(errors) == 1
+
+
+def test_execute_async(password: str, script_server: Tuple[Optional[str], int]) -> None:
+    with PhotoshopConnection(password, port=script_server[1]) as conn:
+        futures = [conn.execute_async('alert("hi")') for _ in range(3)]
+        for future in futures:
+            assert future.result(timeout=5)["body"] == b"{}"
+        assert conn.transactions == {}
+
+
+def test_execute_async_output(
+    password: str, script_output_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnection(password, port=script_output_server[1]) as conn:
+        future = conn.execute_async(SCRIPT, receive_output=True)
+        assert future.result(timeout=5)["body"] == b"{}"
+
+
+def test_password_from_environment(
+    password: str,
+    script_server: Tuple[Optional[str], int],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    monkeypatch.setenv("PHOTOSHOP_PASSWORD", password)
+    with PhotoshopConnection(port=script_server[1]) as conn:
+        conn.ping()
+
+
+def test_configure_socket_error(
+    password: str,
+    script_server: Tuple[Optional[str], int],
+    monkeypatch: pytest.MonkeyPatch,
+) -> None:
+    sockets = []
+
+    def configure_socket(self: PhotoshopConnection, sock: socket.socket) -> None:
+        sockets.append(sock)
+        raise OSError("Protocol not available")
+
+    monkeypatch.setattr(PhotoshopConnection, "_configure_socket", configure_socket)
+    with pytest.raises(OSError):
+        PhotoshopConnection(password, port=script_server[1])
+    assert sockets[0].fileno() == -1
+
+
+def test_execute_stream(
+    password: str, script_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnection(password, port=script_server[1]) as conn:
+        stream = conn.execute_stream(SCRIPT, 1)
+        assert len(conn.transactions) == 1
+        assert [response["body"] for response in stream] == [b"{}"]
+        assert conn.transactions == {}
+        # Dropped or closed before the first response was requested.
+        stream = conn.execute_stream(SCRIPT, 1)
+        del stream
+        assert conn.transactions == {}
+        stream = conn.execute_stream(SCRIPT, 2)
+        stream.close()  # type: ignore
+        assert conn.transactions == {}
+        assert list(stream) == []
+
+
+def test_execute_async_cancel(
+    password: str, silent_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnection(password, port=silent_server[1]) as conn:
+        future = conn.execute_async('alert("hi")')
+        assert len(conn.transactions) == 1
+        assert future.cancel()
+        assert conn.transactions == {}
+
+
+def test_execute_async_early_error(
+    password: str, script_server: Tuple[Optional[str], int]
+) -> None:
+    class FailingFlag(object):
+        """Fails every transaction right as it is registered."""
+
+        def is_set(self) -> bool:
+            for txn in list(conn.transactions.values()):
+                txn.put(OSError("Connection lost"))
+            return True
+
+    with PhotoshopConnection(password, port=script_server[1]) as conn:
+        dispatching = conn._dispatching
+        conn._dispatching = FailingFlag()  # type: ignore
+        try:
+            future = conn.execute_async('alert("hi")')
+        finally:
+            conn._dispatching = dispatching
+        assert isinstance(future.exception(timeout=5), OSError)
+        assert conn.transactions == {}
+
+
+def test_aexecute(password: str, script_server: Tuple[Optional[str], int]) -> None:
+    async def run(conn: PhotoshopConnection) -> List[Dict[str, Any]]:
+        return await asyncio.gather(*(conn.aexecute('alert("hi")') for _ in range(3)))
+
+    with PhotoshopConnection(password, port=script_server[1]) as conn:
+        for response in asyncio.run(run(conn)):
+            assert response["body"] == b"{}"
+
+
+def test_render_cache(password: str, script_server: Tuple[Optional[str], int]) -> None:
+    with PhotoshopConnection(password, port=script_server[1]) as conn:
+        context = dict(path="filename.psd", new_path="filename.psd.dat")
+        script = conn._render("copyAndRemove.js.j2", context)
+        assert conn._render("copyAndRemove.js.j2", dict(context)) is script
+        # Keys the template does not reference do not affect the cache key.
+        assert conn._render("copyAndRemove.js.j2", dict(context, unused=1)) is script
+        # Unhashable values the template references are rendered uncached.
+        thumbnail_context = dict(max_width=1, max_height=1, layer=(1, 2))
+        layer_settings = [{"enabled": True}, {"enabled": False}]
+        script = conn._render(
+            "sendLayerThumbnailToNetworkClient.js.j2",
+            dict(thumbnail_context, layer_settings=layer_settings),
+        )
+        assert script.count('settings.putObject(stringIDToTypeID("layerSettings")') == 2
+        assert "layerSettings" not in conn._render(
+            "sendLayerThumbnailToNetworkClient.js.j2", thumbnail_context
+        )
+
+
+def test_bytecode_cache_unavailable(monkeypatch: pytest.MonkeyPatch) -> None:
+    def unavailable(*args: Any, **kwargs: Any) -> None:
+        raise RuntimeError("Cannot determine safe temp directory")
+
+    monkeypatch.setattr(photoshop_connection, "FileSystemBytecodeCache", unavailable)
+    _bytecode_cache.cache_clear()
+    try:
+        env = PhotoshopConnection._env
+        assert _compile_template(env, "test.js.j2", "{{ x }};").render(x=1) == "1;"
+    finally:
+        _bytecode_cache.cache_clear()
+
+
+def test_open_script() -> None:
+    assert (
+        _open_script("a.psd", None, False) == 'open(File("a.psd"), undefined, false);'
+    )
+    assert (
+        _open_script("a.png", "PNG", True)
+        == 'open(File("a.png"), OpenDocumentType.PNG, true);'
+    )
+
+
+def test_receive_timeout(
+    password: str, script_server: Tuple[Optional[str], int]
+) -> None:
+    with PhotoshopConnection(password, port=script_server[1]) as conn:
+        with conn._transaction() as txn:
+            with pytest.raises(queue.Empty):
+                txn.receive(timeout=0.01)
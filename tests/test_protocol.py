@@ -1,7 +1,8 @@
+import socket
 from typing import Any, Tuple
 
 import pytest
-from photoshop.protocol import Pixmap
+from photoshop.protocol import ContentType, Pixmap, Protocol, SocketReader
 from PIL import Image
 
 
@@ -17,6 +18,92 @@ def test_pixmap(args: Tuple[Any, ...]) -> None:
     pixmap = Pixmap(*args)
     data = pixmap.dump()
     assert Pixmap.parse(data).dump() == data
+    assert Pixmap.parse(memoryview(data)).dump() == data
+    Pixmap.parse(memoryview(data)).__repr__()
     pixmap.__repr__()
     image = pixmap.topil()
     assert image is None or isinstance(image, Image.Image)
+
+
+def test_pixmap_numpy() -> None:
+    np = pytest.importorskip("numpy")
+    data = bytes(range(16))
+    array = Pixmap.parse(memoryview(Pixmap(2, 2, 8, 3, 4, 8, data).dump())).numpy()
+    assert array.shape == (2, 2, 4)
+    assert np.array_equal(array.ravel(), np.frombuffer(data, dtype=np.uint8))
+    # Rows may be padded beyond the pixels.
+    array = Pixmap(2, 2, 8, 3, 3, 8, data).numpy()
+    assert array.shape == (2, 2, 3)
+    assert array[1, 1, 2] == data[8 + 5]
+    with pytest.raises(ValueError):
+        Pixmap(2, 2, 8, 3, 4, 16, data).numpy()
+    with pytest.raises(ValueError):
+        Pixmap(2, 2, 8, 3, 4, 8, data[:12]).numpy()
+
+
+def test_socket_reader() -> None:
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(b"0123456789")
+        reader = SocketReader(right, buffer_size=4)
+        buffer = bytearray(10)
+        view = memoryview(buffer)
+        offset = 0
+        while offset < len(buffer):
+            offset += reader.recv_into(view[offset:], 3)
+        assert buffer == b"0123456789"
+        left.close()
+        assert reader.recv_into(view, 1) == 0
+
+
+def test_read_frames() -> None:
+    protocol = Protocol("secret")
+    left, right = socket.socketpair()
+    with left, right:
+        left.sendall(
+            protocol.pack(ContentType.SCRIPT, b"1", 1)
+            + protocol.pack(ContentType.SCRIPT, b"2", 2)
+        )
+        reader = SocketReader(right)
+        frames = protocol.read_frames(reader)
+        while len(frames) < 2:
+            frames += protocol.read_frames(reader)
+        assert [protocol.parse_frame(frame)["body"] for frame in frames] == [
+            b"1",
+            b"2",
+        ]
+
+
+def test_send_many() -> None:
+    protocol = Protocol("secret")
+    left, right = socket.socketpair()
+    with left, right:
+        protocol.send_many(
+            left, [(ContentType.IMAGE, b"\x01\x00"), (ContentType.SCRIPT, b"1")], 3
+        )
+        image = protocol.receive(right)
+        script = protocol.receive(right)
+        assert image["content_type"] == ContentType.IMAGE
+        assert script["body"] == b"1"
+        assert image["transaction"] == script["transaction"] == 3
+
+
+@pytest.mark.parametrize("size", [16, 2 << 20])
+def test_parse_file_stream(size: int) -> None:
+    protocol = Protocol("secret")
+    header = b'{"position":0,"size":%d}' % size
+    data = b"\x00" * size
+    body = len(header).to_bytes(4, "big") + header + data
+    frame = protocol.pack(ContentType.FILE_STREAM, body)
+    info = protocol.parse_frame(frame[4:])["body"]
+    assert info["size"] == size
+    assert isinstance(info["data"], memoryview)
+    assert info["data"] == data
+
+
+def test_parse_invalid() -> None:
+    with pytest.raises(ValueError):
+        Pixmap.parse(b"\x00" * 14)
+    protocol = Protocol("secret")
+    with pytest.raises(ValueError):
+        protocol.parse_frame(protocol.pack(ContentType.IMAGE, b"")[4:])